@@ -1,7 +1,31 @@
+import hashlib
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
 from spade.agent import Agent
 from spade.message import Message
 
-from sim.protocol import make_message
+from sim.agents.behaviours import PeriodicCall, handles
+from sim.profiling import profiled
+from sim.protocol import (
+    CONTROL_TYPES,
+    MSG_REGISTER,
+    MSG_SHUTDOWN,
+    MSG_SUBSCRIBE,
+    MSG_SUBSCRIBED,
+    MSG_TICK,
+    MSG_TICK_DONE,
+    MSG_UNSUBSCRIBE,
+    make_batch_message,
+    make_message,
+    message_stamp,
+    topic_matches,
+)
+
+
+_OUTBOX = ContextVar("outbox", default=None)
+_STAMP = ContextVar("stamp", default=0)
 
 
 class BaseAgent(Agent):
@@ -9,13 +33,171 @@ class BaseAgent(Agent):
         xmpp = getattr(config, "xmpp", {}) or {}
         super().__init__(jid, password, port=int(xmpp.get("port", 5222)), verify_security=bool(xmpp.get("verify_security", False)))
         self.config = config
+        self.subscribers = {}
+        self.lockstep = bool(config.simulation.get("deterministic", False))
+        self.receiver = None
+        self.inbox = {}
+        self.sent_counts = {}
+        self.pending_round = None
+        self.starting, self.awaiting_acks, self.registration = True, 0, None
+
+    def add_tick_behaviour(self, period) -> None:
+        if not self.lockstep:
+            self.add_behaviour(PeriodicCall("on_tick", period=period))
 
     async def send(self, msg: Message) -> None:
         if msg.empty_sender():
             msg.sender = str(self.jid)
+        if self.lockstep:
+            stamp = _STAMP.get()
+            msg.set_metadata("tick", str(stamp))
+            if stamp > 0 and msg.get_metadata("type") not in CONTROL_TYPES:
+                self.sent_counts.setdefault(stamp, Counter())[str(msg.to)] += 1
         await self.container.send(msg, self)
         msg.sent = True
         self.traces.append(msg, category=str(self))
 
-    async def send_typed(self, to, msg_type, payload) -> None:
+    async def _xmpp_send(self, msg: Message) -> None:
+        msg.prepare(self.client).send()
+
+    async def send_control(self, to, msg_type, payload) -> None:
         await self.send(make_message(to, msg_type, payload))
+
+    async def send_typed(self, to, msg_type, payload, topic=None) -> None:
+        outbox = _OUTBOX.get()
+        if outbox is not None:
+            outbox.setdefault(str(to), []).append((msg_type, payload, topic))
+            return
+        await self.send(make_message(to, msg_type, payload, topic=topic))
+
+    @asynccontextmanager
+    async def batching(self):
+        if _OUTBOX.get() is not None:
+            yield
+            return
+        _OUTBOX.set({})
+        try:
+            yield
+        finally:
+            await self.flush_outbox()
+
+    async def flush_outbox(self) -> None:
+        outbox = _OUTBOX.get() or {}
+        _OUTBOX.set(None)
+        entries_by_recipient = list(outbox.items())
+        outbox.clear()
+        for to, entries in entries_by_recipient:
+            if len(entries) == 1:
+                msg_type, payload, topic = entries[0]
+                await self.send(make_message(to, msg_type, payload, topic=topic))
+            else:
+                await self.send(make_batch_message(to, entries))
+
+    async def stop(self) -> None:
+        await self.flush_outbox()
+        await super().stop()
+
+    def add_subscriber(self, topic, jid, filters=None) -> None:
+        filters = {key: set(values) for key, values in (filters or {}).items()}
+        self.subscribers.setdefault(topic, {})[str(jid)] = filters
+
+    def remove_subscriber(self, topic, jid) -> None:
+        self.subscribers.get(topic, {}).pop(str(jid), None)
+
+    async def subscribe(self, publisher_jid, topic, filters=None) -> None:
+        payload = {"topic": topic, "filters": filters or {}}
+        if self.starting:
+            payload["ack"] = True
+            self.awaiting_acks += 1
+        await self.send_typed(publisher_jid, MSG_SUBSCRIBE, payload)
+
+    async def register(self, world_jid, payload) -> None:
+        self.registration = (world_jid, payload)
+        if not self.awaiting_acks:
+            await self._send_registration()
+
+    async def _send_registration(self) -> None:
+        world_jid, payload = self.registration
+        self.starting, self.registration = False, None
+        await self.send_typed(world_jid, MSG_REGISTER, payload)
+
+    async def unsubscribe(self, publisher_jid, topic) -> None:
+        await self.send_typed(publisher_jid, MSG_UNSUBSCRIBE, {"topic": topic})
+
+    async def publish(self, topic, msg_type, payload) -> None:
+        for jid, filters in list(self.subscribers.get(topic, {}).items()):
+            if topic_matches(filters, payload):
+                await self.send_typed(jid, msg_type, payload, topic=topic)
+
+    @handles(MSG_SUBSCRIBE)
+    async def _handle_subscribe(self, payload, sender) -> None:
+        topic = payload.get("topic")
+        if topic:
+            self.add_subscriber(topic, sender, payload.get("filters"))
+            await self.on_subscribe(topic, sender)
+            if payload.get("ack"):
+                await self.send_typed(sender, MSG_SUBSCRIBED, {"topic": topic})
+
+    @handles(MSG_SUBSCRIBED, serial=True)
+    async def _handle_subscribed(self, payload, sender) -> None:
+        self.awaiting_acks = max(0, self.awaiting_acks - 1)
+        if not self.awaiting_acks and self.registration is not None:
+            await self._send_registration()
+
+    @handles(MSG_UNSUBSCRIBE)
+    async def _handle_unsubscribe(self, payload, sender) -> None:
+        if payload.get("topic"):
+            self.remove_subscriber(payload["topic"], sender)
+
+    @handles(MSG_SHUTDOWN, serial=True)
+    async def _handle_shutdown(self, payload, sender) -> None:
+        await self.stop()
+
+    async def on_subscribe(self, topic, jid) -> None:
+        pass
+
+    def defer_message(self, msg) -> bool:
+        stamp = message_stamp(msg)
+        if stamp <= 0 or msg.get_metadata("type") in CONTROL_TYPES:
+            return False
+        self.inbox.setdefault(stamp, []).append(msg)
+        return True
+
+    def take_sent(self, stamp) -> dict:
+        return dict(self.sent_counts.pop(stamp, {}))
+
+    @handles(MSG_TICK, serial=True)
+    async def _handle_tick(self, payload, sender) -> None:
+        self.pending_round = (int(payload["tick"]), int(payload.get("expect", 0)), sender)
+
+    async def run_pending_round(self) -> None:
+        if self.pending_round is None:
+            return
+        tick, expect, coordinator = self.pending_round
+        messages = self.inbox.get(tick - 1, [])
+        if len(messages) < expect:
+            return
+        self.pending_round = None
+        self.inbox.pop(tick - 1, None)
+        messages.sort(key=lambda msg: str(msg.sender))
+        await self.flush_outbox()
+        token = _STAMP.set(tick)
+        try:
+            async with self.batching():
+                await self.receiver.dispatch(messages, defer=False)
+                on_tick = getattr(self, "on_tick", None)
+                if on_tick is not None:
+                    await profiled(self, "on_tick", on_tick)
+        finally:
+            _STAMP.reset(token)
+        await self.finish_round(tick, coordinator)
+
+    async def finish_round(self, tick, coordinator) -> None:
+        payload = {"tick": tick, "sent": self.take_sent(tick), "digest": self.state_digest()}
+        await self.send_control(coordinator, MSG_TICK_DONE, payload)
+
+    def fingerprint_state(self):
+        return ()
+
+    def state_digest(self) -> str:
+        return hashlib.sha256(repr(self.fingerprint_state()).encode()).hexdigest()[:16]
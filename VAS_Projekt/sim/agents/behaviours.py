@@ -1,6 +1,17 @@
+import asyncio
+
 from spade.behaviour import CyclicBehaviour, OneShotBehaviour, PeriodicBehaviour
 
-from sim.protocol import parse_message
+from sim.profiling import profiled
+from sim.protocol import parse_messages
+
+
+def handles(*msg_types, serial=False):
+    def mark(method):
+        method.handled_types, method.serial = msg_types, serial
+        return method
+
+    return mark
 
 
 class OneShotCall(OneShotBehaviour):
@@ -8,8 +19,12 @@ class OneShotCall(OneShotBehaviour):
         super().__init__()
         self.method_name = method_name
 
+    def match(self, message):
+        return False
+
     async def run(self):
-        await getattr(self.agent, self.method_name)()
+        async with self.agent.batching():
+            await profiled(self.agent, self.method_name, getattr(self.agent, self.method_name))
 
 
 class PeriodicCall(PeriodicBehaviour):
@@ -17,20 +32,68 @@ class PeriodicCall(PeriodicBehaviour):
         super().__init__(period=period)
         self.method_name = method_name
 
+    def match(self, message):
+        return False
+
     async def run(self):
         handler = getattr(self.agent, self.method_name, None)
         if handler is not None:
-            await handler()
+            async with self.agent.batching():
+                await profiled(self.agent, self.method_name, handler)
 
 
 class MessageReceiver(CyclicBehaviour):
-    def __init__(self, *, timeout: float = 1):
+    def __init__(self, *, timeout: float = 1, concurrency: int = None):
         super().__init__()
         self.timeout = timeout
+        self.concurrency = concurrency
+        self.handlers = {}
+
+    async def on_start(self):
+        agent_cls = type(self.agent)
+        for name in dir(agent_cls):
+            method = getattr(agent_cls, name, None)
+            for msg_type in getattr(method, "handled_types", ()):
+                self.handlers[msg_type] = (getattr(self.agent, name), method.serial)
+        if self.concurrency is None:
+            self.concurrency = int(self.agent.config.simulation.get("handler_concurrency", 8))
+        self.limit = asyncio.Semaphore(max(1, self.concurrency))
+        self.agent.receiver = self
 
     async def run(self):
         msg = await self.receive(timeout=self.timeout)
         if not msg:
             return
-        msg_type, payload = parse_message(msg)
-        await self.agent.on_message(msg_type, payload, sender=str(msg.sender))
+        messages = [msg]
+        while self.mailbox_size() > 0:
+            messages.append(await self.receive())
+        async with self.agent.batching():
+            await self.dispatch(messages)
+            if self.agent.lockstep:
+                await self.agent.run_pending_round()
+
+    async def dispatch(self, messages, defer=True):
+        lockstep = self.agent.lockstep
+        pending = []
+        for msg in messages:
+            if defer and lockstep and self.agent.defer_message(msg):
+                continue
+            sender = str(msg.sender)
+            for msg_type, payload in parse_messages(msg):
+                entry = self.handlers.get(msg_type)
+                if entry is None:
+                    continue
+                handler, serial = entry
+                if serial or lockstep:
+                    if pending:
+                        await asyncio.gather(*pending)
+                        pending = []
+                    await profiled(self.agent, handler.__name__, handler, payload, sender)
+                else:
+                    pending.append(asyncio.ensure_future(self._run_limited(handler, payload, sender)))
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def _run_limited(self, handler, payload, sender):
+        async with self.limit:
+            await profiled(self.agent, handler.__name__, handler, payload, sender)
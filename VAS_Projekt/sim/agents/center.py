@@ -2,15 +2,19 @@ import logging
 from collections import deque
 
 from sim.agents.base import BaseAgent
-from sim.agents.behaviours import MessageReceiver, OneShotCall
+from sim.agents.behaviours import MessageReceiver, OneShotCall, handles
+from sim.eventlog import Resources, log_event
+from sim.kpi import KPI
+from sim.pathfinding import dijkstra
 from sim.protocol import (
-    MSG_REGISTER,
+    MSG_LEAD_TIME,
     MSG_RESOURCE_REQUEST,
     MSG_DISPATCH,
-    MSG_SHUTDOWN,
     MSG_VEHICLE_STATUS,
+    lead_time_topic,
+    vehicle_status_topic,
 )
-from sim.utils import allocate_resources, jid_user, normalize_resources, resource_phrase, subtract_resources, total_resources
+from sim.utils import allocate_resources, jid_user, normalize_resources, subtract_resources, total_resources
 
 
 LOGGER = logging.getLogger(__name__)
@@ -39,6 +43,12 @@ class AidCenterAgent(BaseAgent):
         self.available_vehicles = set(vehicle_jids)
         self.pending_requests = deque()
         self.priority_order = ("med", "water", "food")
+        self.dispatch_margin = int(config.simulation.get("dispatch_margin", 2))
+        self.group_locations = {
+            g["jid"]: g["location"] for g in config.groups.values() if g.get("assigned_center") == center_id
+        }
+        self.travel_times = {}
+        self.quoted_queue = 0
 
     async def setup(self):
         self.add_behaviour(OneShotCall("on_start"))
@@ -51,17 +61,47 @@ class AidCenterAgent(BaseAgent):
             "center_id": self.center_id,
             "location": self.location,
         }
-        await self.send_typed(self.world_jid, MSG_REGISTER, payload)
-
-    async def on_message(self, msg_type, payload, sender):
-        if msg_type == MSG_RESOURCE_REQUEST:
-            self.pending_requests.append(payload)
-            await self._try_dispatch()
-        elif msg_type == MSG_VEHICLE_STATUS:
-            self._update_vehicle_status(payload)
-            await self._try_dispatch()
-        elif msg_type == MSG_SHUTDOWN:
-            await self.stop()
+        topic = vehicle_status_topic(jid_user(self.jid))
+        for vehicle_jid in self.vehicle_jids:
+            await self.subscribe(vehicle_jid, topic, {"status": ["idle"]})
+        await self.register(self.world_jid, payload)
+
+    async def on_subscribe(self, topic, jid):
+        if topic == lead_time_topic(jid_user(self.jid)) and jid in self.group_locations:
+            await self.send_typed(jid, MSG_LEAD_TIME, {"lead_time": self._lead_time(self.group_locations[jid])}, topic=topic)
+
+    def _lead_time(self, destination):
+        if destination not in self.travel_times:
+            map_data = self.config.map_data
+            _, cost = dijkstra(self.location, destination, map_data.adjacency, map_data.base_edges, set(), {})
+            self.travel_times[destination] = cost or 0
+        travel = self.travel_times[destination]
+        return travel + self.dispatch_margin + self._queue_depth() * 2 * travel
+
+    def _queue_depth(self):
+        return len(self.pending_requests) // max(1, len(self.vehicle_jids)) + (0 if self.available_vehicles else 1)
+
+    async def _publish_lead_times(self):
+        queued = self._queue_depth()
+        if queued == self.quoted_queue:
+            return
+        self.quoted_queue = queued
+        topic = lead_time_topic(jid_user(self.jid))
+        for jid in sorted(self.subscribers.get(topic, {})):
+            if jid in self.group_locations:
+                await self.send_typed(jid, MSG_LEAD_TIME, {"lead_time": self._lead_time(self.group_locations[jid])}, topic=topic)
+
+    @handles(MSG_RESOURCE_REQUEST, serial=True)
+    async def _handle_resource_request(self, payload, sender):
+        self.pending_requests.append(payload)
+        await self._try_dispatch()
+        await self._publish_lead_times()
+
+    @handles(MSG_VEHICLE_STATUS, serial=True)
+    async def _handle_vehicle_status(self, payload, sender):
+        self._update_vehicle_status(payload)
+        await self._try_dispatch()
+        await self._publish_lead_times()
 
     async def _try_dispatch(self):
         if not self.available_vehicles or not self.pending_requests:
@@ -91,10 +131,22 @@ class AidCenterAgent(BaseAgent):
                 "request_id": request.get("request_id"),
             }
             await self.send_typed(vehicle_jid, MSG_DISPATCH, payload)
-            LOGGER.info(
-                f"Center {self.center_id} at {self.location} dispatched vehicle {jid_user(vehicle_jid)} to {payload['destination']} "
-                f"for group {payload.get('group_id')} (request {payload.get('request_id')}). Loaded: {resource_phrase(shipment)} "
-                f"(capacity {capacity}, used {used_capacity}). Inventory left: {resource_phrase(self.inventory, include_zero=True)}."
+            KPI.record_dispatch(self.center_id, shipment, self.inventory)
+            log_event(
+                LOGGER,
+                "dispatch",
+                "Center {center} at {location} dispatched vehicle {vehicle} to {destination} for group {group} "
+                "(request {request_id}). Loaded: {shipment} (capacity {capacity}, used {used}). Inventory left: {inventory}.",
+                center=self.center_id,
+                location=self.location,
+                vehicle=jid_user(vehicle_jid),
+                destination=payload["destination"],
+                group=payload.get("group_id"),
+                request_id=payload.get("request_id"),
+                shipment=Resources(shipment),
+                capacity=capacity,
+                used=used_capacity,
+                inventory=Resources(self.inventory, include_zero=True),
             )
 
         while requests:
@@ -105,3 +157,10 @@ class AidCenterAgent(BaseAgent):
         vehicle_jid = payload.get("jid")
         if status == "idle" and vehicle_jid in self.vehicle_jids:
             self.available_vehicles.add(vehicle_jid)
+
+    def fingerprint_state(self):
+        return (
+            tuple(self.inventory.items()),
+            tuple(sorted(self.available_vehicles)),
+            tuple(request.get("request_id") for request in self.pending_requests),
+        )
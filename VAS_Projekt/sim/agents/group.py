@@ -1,21 +1,24 @@
 import logging
 
 from sim.agents.base import BaseAgent
-from sim.agents.behaviours import MessageReceiver, OneShotCall, PeriodicCall
+from sim.agents.behaviours import MessageReceiver, OneShotCall, handles
+from sim.eventlog import Resources, log_event
+from sim.kpi import KPI
+from sim.profiling import observe_tick
 from sim.protocol import (
     MSG_DEMAND_UPDATE,
     MSG_DELIVERY,
-    MSG_REGISTER,
+    MSG_LEAD_TIME,
     MSG_RESOURCE_REQUEST,
-    MSG_SHUTDOWN,
+    lead_time_topic,
 )
 from sim.utils import (
+    RESOURCE_TYPES,
     add_resources,
     clamp_resources,
     jid_user,
     normalize_resources,
     resource_diff,
-    resource_phrase,
     subtract_resources,
     total_resources,
 )
@@ -55,10 +58,19 @@ class AidGroupAgent(BaseAgent):
         self.pending_request_id = None
         self.tick = 0
 
+        simulation = self.config.simulation
+        self.forecast_alpha = float(simulation.get("forecast_alpha", 0.2))
+        self.safety_ticks = int(simulation.get("request_safety_ticks", 2))
+        self.spike_rate = {key: 0.0 for key in RESOURCE_TYPES}
+        self.spike_this_tick = normalize_resources({})
+        self.quoted_lead_time = None
+        self.observed_lead_time = None
+        self.request_tick = None
+
     async def setup(self):
         tick_seconds = int(self.config.simulation.get("tick_seconds", 1))
         self.add_behaviour(OneShotCall("on_start"))
-        self.add_behaviour(PeriodicCall("on_tick", period=tick_seconds))
+        self.add_tick_behaviour(tick_seconds)
         self.add_behaviour(MessageReceiver())
 
     async def on_start(self):
@@ -68,41 +80,86 @@ class AidGroupAgent(BaseAgent):
             "group_id": self.group_id,
             "location": self.location,
         }
-        await self.send_typed(self.world_jid, MSG_REGISTER, payload)
+        await self.subscribe(self.assigned_center_jid, lead_time_topic(jid_user(self.assigned_center_jid)))
+        await self.register(self.world_jid, payload)
 
     async def on_tick(self):
         self.tick += 1
+        observe_tick(self.tick)
         self.stock = subtract_resources(self.stock, self.consumption_per_tick)
+        KPI.record_stock(self.group_id, self.stock, self.tick)
+        for key, amount in self.spike_this_tick.items():
+            self.spike_rate[key] += self.forecast_alpha * (amount - self.spike_rate[key])
+        self.spike_this_tick = normalize_resources({})
         await self._maybe_request()
 
-    async def on_message(self, msg_type, payload, sender):
-        if msg_type == MSG_DELIVERY:
-            request_id = payload.get("request_id")
-            source = payload.get("from")
-            resources = normalize_resources(payload.get("resources", {}))
-            self.stock = add_resources(self.stock, resources)
-            self.stock = clamp_resources(self.stock, self.max_capacity)
-            self.pending_request_id = None
-            LOGGER.info(
-                f"Group {self.group_id} at {self.location} received delivery for request {request_id} from center {jid_user(source)}: "
-                f"{resource_phrase(resources)}. Stock now: {resource_phrase(self.stock, include_zero=True)}."
-            )
-        elif msg_type == MSG_DEMAND_UPDATE:
-            amounts = normalize_resources(payload.get("amounts", {}))
-            self.stock = subtract_resources(self.stock, amounts)
-            LOGGER.info(
-                f"Group {self.group_id} at {self.location} had a sudden demand spike (consumed: {resource_phrase(amounts)}). "
-                f"Stock now: {resource_phrase(self.stock, include_zero=True)}."
-            )
-        elif msg_type == MSG_SHUTDOWN:
-            await self.stop()
+    @handles(MSG_DELIVERY)
+    async def _handle_delivery(self, payload, sender):
+        request_id = payload.get("request_id")
+        source = payload.get("from")
+        resources = normalize_resources(payload.get("resources", {}))
+        self.stock = add_resources(self.stock, resources)
+        self.stock = clamp_resources(self.stock, self.max_capacity)
+        if request_id == self.pending_request_id and self.request_tick is not None:
+            observed = self.tick - self.request_tick
+            if self.observed_lead_time is None:
+                self.observed_lead_time = float(observed)
+            else:
+                self.observed_lead_time += self.forecast_alpha * (observed - self.observed_lead_time)
+        self.pending_request_id = None
+        KPI.record_delivery(request_id, self.tick)
+        log_event(
+            LOGGER,
+            "delivery",
+            "Group {group} at {location} received delivery for request {request_id} from center {center}: {resources}. "
+            "Stock now: {stock}.",
+            group=self.group_id,
+            location=self.location,
+            request_id=request_id,
+            center=jid_user(source),
+            resources=Resources(resources),
+            stock=Resources(self.stock, include_zero=True),
+        )
+
+    @handles(MSG_DEMAND_UPDATE)
+    async def _handle_demand_update(self, payload, sender):
+        amounts = normalize_resources(payload.get("amounts", {}))
+        self.stock = subtract_resources(self.stock, amounts)
+        self.spike_this_tick = add_resources(self.spike_this_tick, amounts)
+        log_event(
+            LOGGER,
+            "demand",
+            "Group {group} at {location} had a sudden demand spike (consumed: {consumed}). Stock now: {stock}.",
+            group=self.group_id,
+            location=self.location,
+            consumed=Resources(amounts),
+            stock=Resources(self.stock, include_zero=True),
+        )
+
+    @handles(MSG_LEAD_TIME)
+    async def _handle_lead_time(self, payload, sender):
+        self.quoted_lead_time = float(payload.get("lead_time", 0))
+
+    def _lead_time(self):
+        return self.observed_lead_time if self.observed_lead_time is not None else self.quoted_lead_time
+
+    def _demand_rate(self):
+        return {key: self.consumption_per_tick[key] + self.spike_rate[key] for key in self.stock}
+
+    def _forecast_stockout(self, rate, lead_time):
+        if lead_time is None:
+            return False
+        horizon = lead_time + self.safety_ticks
+        return any(rate[k] > 0 and self.stock[k] <= rate[k] * horizon for k in self.stock)
 
     async def _maybe_request(self):
-        if self.pending_request_id is not None or self.tick - self.last_request_tick < self.request_cooldown or not any(
-            self.stock[k] < self.min_threshold[k] for k in self.stock
-        ):
+        if self.pending_request_id is not None or self.tick - self.last_request_tick < self.request_cooldown:
             return
-        need = resource_diff(self.max_capacity, self.stock)
+        rate, lead_time = self._demand_rate(), self._lead_time()
+        if not any(self.stock[k] < self.min_threshold[k] for k in self.stock) and not self._forecast_stockout(rate, lead_time):
+            return
+        expected = {k: max(0, self.stock[k] - int(rate[k] * (lead_time or 0))) for k in self.stock}
+        need = resource_diff(self.max_capacity, expected)
         if total_resources(need) <= 0:
             return
         self.request_seq += 1
@@ -115,9 +172,27 @@ class AidGroupAgent(BaseAgent):
             "request_id": request_id,
         }
         await self.send_typed(self.assigned_center_jid, MSG_RESOURCE_REQUEST, payload)
-        self.last_request_tick = self.tick
+        self.last_request_tick = self.request_tick = self.tick
         self.pending_request_id = request_id
-        LOGGER.info(
-            f"Group {self.group_id} at {self.location} sent request {request_id} to center {jid_user(self.assigned_center_jid)}. "
-            f"Needs: {resource_phrase(need)}. Current stock: {resource_phrase(self.stock, include_zero=True)}."
+        KPI.record_request(request_id, self.tick)
+        log_event(
+            LOGGER,
+            "request",
+            "Group {group} at {location} sent request {request_id} to center {center}. Needs: {needs}. Current stock: {stock}.",
+            group=self.group_id,
+            location=self.location,
+            request_id=request_id,
+            center=jid_user(self.assigned_center_jid),
+            needs=Resources(need),
+            stock=Resources(self.stock, include_zero=True),
+        )
+
+    def fingerprint_state(self):
+        return (
+            self.tick,
+            tuple(self.stock.items()),
+            self.pending_request_id,
+            self.quoted_lead_time,
+            self.observed_lead_time,
+            tuple(self.spike_rate.items()),
         )
@@ -1,18 +1,20 @@
 import logging
 
 from sim.agents.base import BaseAgent
-from sim.agents.behaviours import MessageReceiver, OneShotCall, PeriodicCall
+from sim.agents.behaviours import MessageReceiver, OneShotCall, handles
+from sim.eventlog import Resources, log_event
+from sim.kpi import KPI
 from sim.pathfinding import dijkstra
 from sim.protocol import (
     MSG_ATTACK,
     MSG_DISPATCH,
-    MSG_REGISTER,
-    MSG_SHUTDOWN,
     MSG_VEHICLE_STATUS,
     MSG_WORLD_UPDATE,
     MSG_DELIVERY,
+    TOPIC_WORLD_INCIDENTS,
+    vehicle_status_topic,
 )
-from sim.utils import normalize_resources, resource_phrase
+from sim.utils import jid_user, normalize_resources, subtract_resources
 
 
 LOGGER = logging.getLogger(__name__)
@@ -42,12 +44,15 @@ class VehicleAgent(BaseAgent):
         self.route, self.edge_remaining = [], 0
         self.known_closed, self.known_delays = set(), {}
         self.pending_delay = 0
+        self.status_topic = vehicle_status_topic(jid_user(home_center_jid))
+        self.incident_filters = None
+        self.add_subscriber(self.status_topic, world_jid)
 
     async def setup(self):
         tick_seconds = int(self.config.simulation.get("tick_seconds", 1))
         self.add_behaviour(OneShotCall("on_start"))
         self.add_behaviour(MessageReceiver())
-        self.add_behaviour(PeriodicCall("on_tick", period=tick_seconds))
+        self.add_tick_behaviour(tick_seconds)
 
     async def on_start(self):
         payload = {
@@ -56,46 +61,74 @@ class VehicleAgent(BaseAgent):
             "vehicle_id": self.vehicle_id,
             "location": self.location,
         }
-        await self.send_typed(self.world_jid, MSG_REGISTER, payload)
-        await self._send_status(to_center=False)
-
-    async def on_message(self, msg_type, payload, sender):
-        if msg_type == MSG_DISPATCH:
-            self.destination = payload.get("destination")
-            self.group_jid = payload.get("group_jid")
-            self.group_id = payload.get("group_id")
-            self.request_id = payload.get("request_id")
-            self.cargo = normalize_resources(payload.get("resources", {}))
-            self.status = "en_route"
-            self.route = []
-            self.edge_remaining = 0
-            LOGGER.info(
-                f"Vehicle {self.vehicle_id} started from {self.location} to {self.destination} for group {self.group_id} "
-                f"(request {self.request_id}). Cargo: {resource_phrase(self.cargo)}."
-            )
-            self._plan_route()
-            await self._send_status()
-        elif msg_type == MSG_WORLD_UPDATE:
-            self._update_world(payload)
-        elif msg_type == MSG_ATTACK:
-            delay = int(payload.get("delay", 0))
-            loss = float(payload.get("loss", 0))
-            if delay > 0:
-                if self.status in ("en_route", "returning") and self.edge_remaining > 0:
-                    self.edge_remaining += delay
-                else:
-                    self.pending_delay += delay
-            if loss > 0 and self.status in ("en_route", "returning"):
-                for key in self.cargo:
-                    self.cargo[key] = max(0, int(self.cargo[key] * (1 - loss)))
-            LOGGER.info(
-                f"Vehicle {self.vehicle_id} was attacked (request {self.request_id}): delay +{delay}, loss {loss * 100:.0f}%. "
-                f"Cargo now: {resource_phrase(self.cargo)}."
-            )
-        elif msg_type == MSG_SHUTDOWN:
-            await self.stop()
+        await self._send_status(initial=True)
+        await self._watch_route()
+        await self.register(self.world_jid, payload)
+
+    @handles(MSG_DISPATCH, serial=True)
+    async def _handle_dispatch(self, payload, sender):
+        self.destination = payload.get("destination")
+        self.group_jid = payload.get("group_jid")
+        self.group_id = payload.get("group_id")
+        self.request_id = payload.get("request_id")
+        self.cargo = normalize_resources(payload.get("resources", {}))
+        self.status = "en_route"
+        self.route = []
+        self.edge_remaining = 0
+        log_event(
+            LOGGER,
+            "departure",
+            "Vehicle {vehicle} started from {location} to {destination} for group {group} (request {request_id}). Cargo: {cargo}.",
+            vehicle=self.vehicle_id,
+            location=self.location,
+            destination=self.destination,
+            group=self.group_id,
+            request_id=self.request_id,
+            cargo=Resources(self.cargo),
+        )
+        await self._plan_route()
+        await self._send_status()
+
+    @handles(MSG_WORLD_UPDATE)
+    async def _handle_world_update(self, payload, sender):
+        closed, delays = self.known_closed, self.known_delays
+        self._update_world(payload)
+        if self.status not in ("en_route", "returning") or not self.route:
+            return
+        nodes = [self.location, *self.route]
+        if any(
+            (edge in closed) != (edge in self.known_closed) or delays.get(edge) != self.known_delays.get(edge)
+            for edge in zip(nodes, nodes[1:])
+        ):
+            await self._replan_route()
+
+    @handles(MSG_ATTACK)
+    async def _handle_attack(self, payload, sender):
+        delay = int(payload.get("delay", 0))
+        loss = float(payload.get("loss", 0))
+        if delay > 0:
+            if self.status in ("en_route", "returning") and self.edge_remaining > 0:
+                self.edge_remaining += delay
+            else:
+                self.pending_delay += delay
+        if loss > 0 and self.status in ("en_route", "returning"):
+            before = dict(self.cargo)
+            for key in self.cargo:
+                self.cargo[key] = max(0, int(self.cargo[key] * (1 - loss)))
+            KPI.record_attack(subtract_resources(before, self.cargo))
+        log_event(
+            LOGGER,
+            "attack",
+            "Vehicle {vehicle} was attacked (request {request_id}): delay +{delay}, loss {loss:.0%}. Cargo now: {cargo}.",
+            vehicle=self.vehicle_id,
+            request_id=self.request_id,
+            delay=delay,
+            loss=loss,
+            cargo=Resources(self.cargo),
+        )
 
     async def on_tick(self):
+        KPI.record_vehicle(self.vehicle_id, self.status in ("en_route", "returning"))
         if self.status not in ("en_route", "returning"):
             return
 
@@ -117,7 +150,7 @@ class VehicleAgent(BaseAgent):
             return
 
         if not self.route:
-            self._plan_route()
+            await self._plan_route()
             if not self.route:
                 return
         edge = (self.location, self.route[0])
@@ -128,9 +161,10 @@ class VehicleAgent(BaseAgent):
         self.pending_delay = 0
         self.edge_remaining = max(1, travel_time)
 
-    def _plan_route(self):
+    async def _plan_route(self):
         if not self.destination or self.location == self.destination:
             self.route = []
+            await self._watch_route()
             return
         path, _ = dijkstra(
             self.location,
@@ -141,17 +175,46 @@ class VehicleAgent(BaseAgent):
             self.known_delays,
         )
         self.route = path[1:] if path else []
+        await self._watch_route()
+
+    async def _replan_route(self):
+        if self.edge_remaining <= 0:
+            await self._plan_route()
+            return
+        next_node = self.route[0]
+        path, _ = dijkstra(
+            next_node,
+            self.destination,
+            self.adjacency,
+            self.base_edges,
+            self.known_closed,
+            self.known_delays,
+        )
+        self.route = [next_node, *path[1:]] if path else [next_node]
+        await self._watch_route()
 
-    async def _send_status(self, *, to_center: bool = True):
+    async def _watch_route(self):
+        if self.route:
+            filters = {"nodes": sorted({self.location, *self.route})}
+        elif self.destination and self.location != self.destination:
+            filters = {}
+        else:
+            filters = {"nodes": []}
+        if filters != self.incident_filters:
+            self.incident_filters = filters
+            await self.subscribe(self.world_jid, TOPIC_WORLD_INCIDENTS, filters)
+
+    async def _send_status(self, *, initial: bool = False):
         payload = {
             "jid": str(self.jid),
             "vehicle_id": self.vehicle_id,
             "status": self.status,
             "location": self.location,
         }
-        await self.send_typed(self.world_jid, MSG_VEHICLE_STATUS, payload)
-        if to_center:
-            await self.send_typed(self.home_center_jid, MSG_VEHICLE_STATUS, payload)
+        if initial:
+            await self.send_typed(self.world_jid, MSG_VEHICLE_STATUS, payload)
+        else:
+            await self.publish(self.status_topic, MSG_VEHICLE_STATUS, payload)
 
     async def _deliver(self):
         if not self.group_jid:
@@ -163,23 +226,44 @@ class VehicleAgent(BaseAgent):
             "request_id": self.request_id,
         }
         await self.send_typed(self.group_jid, MSG_DELIVERY, payload)
-        LOGGER.info(
-            f"Vehicle {self.vehicle_id} delivered to group {self.group_id} at {self.location} (request {self.request_id}): "
-            f"{resource_phrase(self.cargo)}."
+        log_event(
+            LOGGER,
+            "delivery",
+            "Vehicle {vehicle} delivered to group {group} at {location} (request {request_id}): {cargo}.",
+            vehicle=self.vehicle_id,
+            group=self.group_id,
+            location=self.location,
+            request_id=self.request_id,
+            cargo=Resources(self.cargo),
         )
         self.cargo = normalize_resources({})
         self.destination, self.status = self.home_location, "returning"
         self.route, self.edge_remaining = [], 0
-        self._plan_route()
+        await self._plan_route()
         await self._send_status()
 
     async def _arrive_home(self):
         self.status, self.destination = "idle", None
         self.group_jid = self.group_id = self.request_id = None
         self.route, self.edge_remaining = [], 0
+        await self._watch_route()
         await self._send_status()
-        LOGGER.info(f"Vehicle {self.vehicle_id} returned to base ({self.home_location}).")
+        log_event(
+            LOGGER, "return", "Vehicle {vehicle} returned to base ({location}).", vehicle=self.vehicle_id, location=self.home_location
+        )
 
     def _update_world(self, payload):
         self.known_closed = {(e["from"], e["to"]) for e in payload.get("closed_edges", [])}
         self.known_delays = {(e["from"], e["to"]): int(e["extra"]) for e in payload.get("delays", [])}
+
+    def fingerprint_state(self):
+        return (
+            self.location,
+            self.status,
+            self.destination,
+            self.request_id,
+            tuple(self.cargo.items()),
+            tuple(self.route),
+            self.edge_remaining,
+            self.pending_delay,
+        )
@@ -1,20 +1,31 @@
+import asyncio
+import hashlib
+import json
 import logging
 import random
+from collections import Counter
 
 from sim.agents.base import BaseAgent
-from sim.agents.behaviours import MessageReceiver, PeriodicCall
+from sim.agents.behaviours import MessageReceiver, PeriodicCall, handles
+from sim.eventlog import log_event
+from sim.profiling import observe_tick
 from sim.protocol import (
     MSG_ATTACK,
     MSG_DEMAND_UPDATE,
     MSG_REGISTER,
     MSG_SHUTDOWN,
+    MSG_TICK,
+    MSG_TICK_DONE,
     MSG_VEHICLE_STATUS,
     MSG_WORLD_UPDATE,
+    TOPIC_WORLD_INCIDENTS,
 )
+from sim.spatial import GridIndex
 from sim.utils import normalize_resources
 
 
 LOGGER = logging.getLogger(__name__)
+MOVING_STATUSES = ("en_route", "returning")
 
 
 class WorldAgent(BaseAgent):
@@ -26,34 +37,73 @@ class WorldAgent(BaseAgent):
         self.max_ticks = int(config.simulation.get("max_ticks", 60))
         self.random = random.Random(config.simulation.get("random_seed", 0))
 
+        locations = self.map_data.locations
+        self.location_names = list(locations)
+        self.location_index = GridIndex.from_points((name, (loc["x"], loc["y"])) for name, loc in locations.items())
+        self.roads_by_location = {}
+        for road in self.map_data.roads:
+            self.roads_by_location.setdefault(road["from"], []).append(road)
+            self.roads_by_location.setdefault(road["to"], []).append(road)
+        self.center_index = GridIndex(self.location_index.cell_size)
+        for center in config.centers.values():
+            if center["location"] in locations:
+                self.center_index.insert(center["id"], *self._coords(center["location"]))
+        self.moving_vehicles = GridIndex(self.location_index.cell_size)
+
         self.tick = 0
         self.closed_edges = {}
         self.delay_edges = {}
         self.registered = {"center": set(), "vehicle": set(), "group": set()}
         self.vehicle_status = {}
+        self.published_closed, self.published_delays = set(), {}
+        agents_cfg = config.agents
+        self.expected = {
+            "center": len(agents_cfg.get("centers", [])),
+            "vehicle": len(agents_cfg.get("vehicles", [])),
+            "group": len(agents_cfg.get("groups", [])),
+        }
+        self.ready, self.finished = asyncio.Event(), asyncio.Event()
+
+        self.fingerprint = ""
+        self.fingerprint_file = config.simulation.get("fingerprint_file")
+        self.fingerprint_handle = None
+        self.participants = []
+        self.round_done, self.round_digests = set(), {}
+        self.round_sent, self.expected_sent = Counter(), Counter()
 
     async def setup(self):
-        self.add_behaviour(PeriodicCall("on_tick", period=self.tick_seconds))
         self.add_behaviour(MessageReceiver())
 
+    def begin(self):
+        if self.ready.is_set():
+            return
+        self.ready.set()
+        if self.lockstep:
+            if self.fingerprint_file:
+                self.fingerprint_handle = open(self.fingerprint_file, "w", encoding="utf-8")
+            self.pending_round = (1, 0, None)
+            asyncio.ensure_future(self.run_pending_round())
+        else:
+            self.add_behaviour(PeriodicCall("on_tick", period=self.tick_seconds))
+
     async def on_tick(self):
         self.tick += 1
+        observe_tick(self.tick)
         self._decrement_events()
         await self._maybe_close_road()
         await self._maybe_add_delay()
+        await self._maybe_storm()
         await self._maybe_attack()
+        await self._maybe_zone_attacks()
         await self._maybe_demand_spike()
         await self._broadcast_update()
 
         if self.tick >= self.max_ticks:
             await self._broadcast_shutdown()
+            if self.lockstep:
+                self._close_fingerprint()
             await self.stop()
-
-    async def on_message(self, msg_type, payload, sender):
-        if msg_type == MSG_REGISTER:
-            await self._handle_register(payload, sender)
-        elif msg_type == MSG_VEHICLE_STATUS:
-            await self._handle_vehicle_status(payload, sender)
+            self.finished.set()
 
     def _get_prob(self, key, default):
         return float(self.events.get(key, default))
@@ -69,15 +119,23 @@ class WorldAgent(BaseAgent):
             "delays": [{"from": a, "to": b, "extra": i["extra"], "ttl": i["ttl"]} for (a, b), i in self.delay_edges.items()],
         }
 
+    def _changed_nodes(self):
+        closed = set(self.closed_edges)
+        delays = {edge: info["extra"] for edge, info in self.delay_edges.items()}
+        changed = closed ^ self.published_closed
+        changed.update(e for e in delays.keys() | self.published_delays.keys() if delays.get(e) != self.published_delays.get(e))
+        self.published_closed, self.published_delays = closed, delays
+        return sorted({node for edge in changed for node in edge})
+
     async def _broadcast_update(self):
         payload = self._world_update_payload()
-        for jid in self.registered.get("vehicle", set()):
-            await self.send_typed(jid, MSG_WORLD_UPDATE, payload)
+        payload["nodes"] = self._changed_nodes()
+        await self.publish(TOPIC_WORLD_INCIDENTS, MSG_WORLD_UPDATE, payload)
 
     async def _broadcast_shutdown(self):
         payload = {"tick": self.tick}
         for jid in set().union(*self.registered.values()):
-            await self.send_typed(jid, MSG_SHUTDOWN, payload)
+            await self.send_control(jid, MSG_SHUTDOWN, payload)
 
     def _decrement_events(self):
         for edge in list(self.closed_edges):
@@ -98,7 +156,9 @@ class WorldAgent(BaseAgent):
             road = self.random.choice(self.map_data.roads)
             ttl = self.random.randint(*self._get_range("road_close_duration", 2, 5))
             self._apply_closure(road, ttl)
-            LOGGER.info(f"Road {road['from']} -> {road['to']} is closed (for {ttl} ticks).")
+            log_event(
+                LOGGER, "road", "Road {a} -> {b} is closed (for {ttl} ticks).", a=road["from"], b=road["to"], ttl=ttl
+            )
 
     async def _maybe_add_delay(self):
         if self.map_data.roads and self.random.random() <= self._get_prob("delay_prob", 0.1):
@@ -106,16 +166,64 @@ class WorldAgent(BaseAgent):
             ttl = self.random.randint(*self._get_range("delay_duration", 2, 4))
             extra = self.random.randint(*self._get_range("delay_amount", 1, 3))
             self._apply_delay(road, extra, ttl)
-            LOGGER.info(f"Traffic on road {road['from']} -> {road['to']}: +{extra} travel time (for {ttl} more ticks).")
+            log_event(
+                LOGGER,
+                "traffic",
+                "Traffic on road {a} -> {b}: +{extra} travel time (for {ttl} more ticks).",
+                a=road["from"],
+                b=road["to"],
+                extra=extra,
+                ttl=ttl,
+            )
+
+    def _coords(self, location):
+        loc = self.map_data.locations[location]
+        return loc["x"], loc["y"]
+
+    def nearest_center(self, location):
+        return self.center_index.nearest(*self._coords(location))
+
+    async def _maybe_storm(self):
+        prob = self._get_prob("storm_prob", 0.0)
+        if prob <= 0 or not self.location_names or self.random.random() > prob:
+            return
+        origin = self.random.choice(self.location_names)
+        radius_min, radius_max = self.events.get("storm_radius", [1, 3])
+        radius = self.random.uniform(float(radius_min), float(radius_max))
+        ttl = self.random.randint(*self._get_range("storm_duration", 2, 5))
+        roads = {}
+        for location in self.location_index.within(*self._coords(origin), radius):
+            for road in self.roads_by_location.get(location, ()):
+                roads[id(road)] = road
+        for road in roads.values():
+            self._apply_closure(road, ttl)
+        log_event(
+            LOGGER,
+            "storm",
+            "Storm around {origin} (radius {radius:.1f}) closes {count} roads for {ttl} ticks. Nearest center: {center}.",
+            origin=origin,
+            radius=radius,
+            count=len(roads),
+            ttl=ttl,
+            center=self.nearest_center(origin),
+        )
 
     async def _maybe_attack(self):
         prob = self._get_prob("attack_prob", 0.05)
-        if self.random.random() > prob or not self.vehicle_status:
+        if self.random.random() > prob or not self.moving_vehicles:
             return
-        candidates = [jid for jid, info in self.vehicle_status.items() if info.get("status") in ("en_route", "returning")]
-        if not candidates:
-            return
-        target = self.random.choice(candidates)
+        await self._attack(self.moving_vehicles.choice(self.random))
+
+    async def _maybe_zone_attacks(self):
+        for zone in self.events.get("attack_zones") or []:
+            if not self.moving_vehicles or self.random.random() > float(zone.get("prob", 0.1)):
+                continue
+            origin = self._coords(zone["location"]) if "location" in zone else (zone["x"], zone["y"])
+            candidates = self.moving_vehicles.within(*origin, float(zone.get("radius", 1)))
+            if candidates:
+                await self._attack(self.random.choice(candidates))
+
+    async def _attack(self, target):
         delay_min, delay_max = self._get_range("attack_delay", 1, 3)
         loss_min, loss_max = self.events.get("attack_loss", [0.1, 0.3])
         payload = {
@@ -126,7 +234,7 @@ class WorldAgent(BaseAgent):
 
     async def _maybe_demand_spike(self):
         prob = self._get_prob("demand_spike_prob", 0.1)
-        groups = list(self.registered.get("group", []))
+        groups = sorted(self.registered.get("group", []))
         if self.random.random() > prob or not groups:
             return
         target = self.random.choice(groups)
@@ -147,15 +255,74 @@ class WorldAgent(BaseAgent):
         if road.get("bidirectional", True):
             self.delay_edges[(b, a)] = {"extra": extra, "ttl": ttl}
 
+    @handles(MSG_REGISTER)
     async def _handle_register(self, payload, sender):
         agent_type = payload.get("agent_type")
         if agent_type in self.registered:
             self.registered[agent_type].add(sender)
-            if agent_type == "vehicle":
-                await self._send_initial_update(sender)
+            if all(len(self.registered[kind]) >= count for kind, count in self.expected.items()):
+                self.begin()
+
+    async def finish_round(self, tick, coordinator):
+        if tick >= self.max_ticks:
+            return
+        self.participants = sorted(set().union(*self.registered.values()))
+        self.round_done = set()
+        self.round_digests = {str(self.jid): self.state_digest()}
+        self.round_sent = Counter(self.take_sent(tick))
+        for jid in self.participants:
+            await self.send_control(jid, MSG_TICK, {"tick": tick, "expect": self.expected_sent.get(jid, 0)})
+        self._maybe_close_round()
+        if not self.participants:
+            asyncio.ensure_future(self.run_pending_round())
+
+    @handles(MSG_TICK_DONE, serial=True)
+    async def _handle_tick_done(self, payload, sender):
+        if int(payload.get("tick", -1)) != self.tick:
+            return
+        self.round_done.add(sender)
+        self.round_sent.update(payload.get("sent", {}))
+        self.round_digests[sender] = payload.get("digest")
+        self._maybe_close_round()
+
+    def _maybe_close_round(self):
+        if self.pending_round is not None or not self.round_done.issuperset(self.participants):
+            return
+        self._record_fingerprint()
+        self.expected_sent = self.round_sent
+        self.pending_round = (self.tick + 1, self.expected_sent.get(str(self.jid), 0), None)
+
+    def _record_fingerprint(self):
+        digests = ";".join(f"{jid}={digest}" for jid, digest in sorted(self.round_digests.items()))
+        self.fingerprint = hashlib.sha256(f"{self.fingerprint}|{self.tick}|{digests}".encode()).hexdigest()
+        if self.fingerprint_handle is not None:
+            self.fingerprint_handle.write(json.dumps({"tick": self.tick, "fingerprint": self.fingerprint}) + "\n")
+
+    def _close_fingerprint(self):
+        self.round_digests = {str(self.jid): self.state_digest()}
+        self._record_fingerprint()
+        log_event(LOGGER, "fingerprint", "Run fingerprint after tick {tick}: {fingerprint}", tick=self.tick, fingerprint=self.fingerprint)
+        if self.fingerprint_handle is not None:
+            self.fingerprint_handle.close()
+            self.fingerprint_handle = None
+
+    def fingerprint_state(self):
+        return (
+            self.tick,
+            sorted(self.closed_edges.items()),
+            sorted((edge, info["extra"], info["ttl"]) for edge, info in self.delay_edges.items()),
+            sorted((jid, info["status"], info["location"]) for jid, info in self.vehicle_status.items()),
+        )
 
-    async def _send_initial_update(self, jid):
-        await self.send_typed(jid, MSG_WORLD_UPDATE, self._world_update_payload())
+    async def on_subscribe(self, topic, jid):
+        if topic == TOPIC_WORLD_INCIDENTS:
+            await self.send_typed(jid, MSG_WORLD_UPDATE, self._world_update_payload(), topic=topic)
 
+    @handles(MSG_VEHICLE_STATUS)
     async def _handle_vehicle_status(self, payload, sender):
-        self.vehicle_status[sender] = {"status": payload.get("status"), "location": payload.get("location")}
+        status, location = payload.get("status"), payload.get("location")
+        self.vehicle_status[sender] = {"status": status, "location": location}
+        if status in MOVING_STATUSES and location in self.map_data.locations:
+            self.moving_vehicles.insert(sender, *self._coords(location))
+        else:
+            self.moving_vehicles.remove(sender)
@@ -1,7 +1,18 @@
-from dataclasses import dataclass
+import csv
+import hashlib
+import inspect
+import os
+import pickle
+from dataclasses import dataclass, field, fields
 
 import yaml
 
+from sim.spatial import GridIndex
+
+_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+CACHE_DIR = ".config_cache"
+
+
 @dataclass
 class MapData:
     locations: dict
@@ -17,19 +28,87 @@ class Config:
     map_data: MapData
     events: dict
     agents: dict
+    centers: dict = field(default_factory=dict)
+    vehicles: dict = field(default_factory=dict)
+    groups: dict = field(default_factory=dict)
+    logging: dict = field(default_factory=dict)
+    kpi: dict = field(default_factory=dict)
+
+
+NUMERIC_COLUMNS = frozenset(("x", "y", "base_time", "capacity"))
+NUMERIC_GROUPS = frozenset(("stock", "inventory", "min_threshold", "max_capacity", "consumption_per_tick"))
+
+
+def _compiler_digest():
+    digest = hashlib.sha256(repr([f.name for cls in (Config, MapData) for f in fields(cls)]).encode())
+    for path in (__file__, inspect.getsourcefile(GridIndex)):
+        try:
+            with open(path, "rb") as handle:
+                digest.update(handle.read())
+        except (OSError, TypeError):
+            pass
+    return digest.hexdigest()
+
+
+COMPILER_DIGEST = _compiler_digest()
+
+
+def _scalar(text):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
 
+def _read_csv(path):
+    with open(path, "r", encoding="utf-8", newline="") as handle:
+        for row in csv.DictReader(handle):
+            item = {}
+            for key, value in row.items():
+                if value is None or value == "":
+                    continue
+                target, *rest = key.strip().split(".")
+                value = value.strip()
+                if rest:
+                    item.setdefault(target, {})[rest[0]] = _scalar(value) if target in NUMERIC_GROUPS else value
+                else:
+                    item[target] = _scalar(value) if target in NUMERIC_COLUMNS else value
+            yield item
 
-def _build_map(map_cfg):
-    locations = {loc["name"]: {"x": loc["x"], "y": loc["y"]} for loc in map_cfg.get("locations", [])}
-    roads = map_cfg.get("roads", [])
+
+def _rows(section, key, base_dir, sources):
+    yield from section.get(key, None) or []
+    path = section.get(f"{key}_file")
+    if path:
+        path = os.path.join(base_dir, path)
+        sources.append(path)
+        yield from _read_csv(path)
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() not in ("0", "false", "no")
+    return bool(value)
+
+
+def _build_map(map_cfg, base_dir=".", sources=None):
+    sources = [] if sources is None else sources
+    locations = {
+        loc["name"]: {"x": loc["x"], "y": loc["y"]} for loc in _rows(map_cfg, "locations", base_dir, sources)
+    }
+    roads = []
     base_edges = {}
     adjacency = {name: [] for name in locations}
 
-    for road in roads:
+    for road in _rows(map_cfg, "roads", base_dir, sources):
         a = road["from"]
         b = road["to"]
         base_time = int(road["base_time"])
-        bidirectional = road.get("bidirectional", True)
+        bidirectional = _flag(road.get("bidirectional", True))
+        road["bidirectional"] = bidirectional
+        roads.append(road)
 
         base_edges[(a, b)] = base_time
         adjacency.setdefault(a, []).append(b)
@@ -42,16 +121,154 @@ def _build_map(map_cfg):
     )
 
 
-def load_config(path):
-    with open(path, "r", encoding="utf-8") as handle:
-        data = yaml.safe_load(handle) or {}
+def _index(items, kind):
+    result = {}
+    for item in items:
+        if item["id"] in result:
+            raise ValueError(f"Duplicate {kind} id: {item['id']}")
+        result[item["id"]] = item
+    return result
+
 
-    simulation = data.get("simulation", {})
-    xmpp = data.get("xmpp", {})
-    map_data = _build_map(data.get("map", {}))
-    events = data.get("events", {})
-    agents = data.get("agents", {})
+def require(mapping, key, kind):
+    if key not in mapping:
+        raise ValueError(f"Unknown {kind} id: {key}")
+    return mapping[key]
 
-    return Config(
-        simulation=simulation, xmpp=xmpp, map_data=map_data, events=events, agents=agents
+
+def _assign_nearest_centers(groups, centers, locations):
+    unassigned = [group for group in groups.values() if not group.get("assigned_center")]
+    if not unassigned:
+        return
+    index = GridIndex.from_points(
+        (center["id"], (locations[center["location"]]["x"], locations[center["location"]]["y"]))
+        for center in centers.values()
+        if center.get("location") in locations
     )
+    for group in unassigned:
+        location = require(locations, group["location"], "location")
+        group["assigned_center"] = index.nearest(location["x"], location["y"])
+        if group["assigned_center"] is None:
+            raise ValueError(f"No center to assign group {group['id']} to")
+
+
+def _check_attack_zones(events, locations):
+    for zone in events.get("attack_zones") or []:
+        if "location" in zone:
+            require(locations, zone["location"], "location")
+        elif not all(isinstance(zone.get(axis), (int, float)) for axis in ("x", "y")):
+            raise ValueError(f"Attack zone needs a location or numeric x and y: {zone}")
+        radius = zone.get("radius", 1)
+        if not isinstance(radius, (int, float)) or radius <= 0:
+            raise ValueError(f"Attack zone radius must be a positive number: {zone}")
+
+
+def _compile(data, base_dir):
+    sources = []
+    map_data = _build_map(data.get("map", {}), base_dir, sources)
+    agents = dict(data.get("agents", {}))
+    if not agents.get("world"):
+        raise ValueError("Missing world agent config")
+
+    centers = _index(_rows(agents, "centers", base_dir, sources), "center")
+    vehicles = _index(_rows(agents, "vehicles", base_dir, sources), "vehicle")
+    groups = _index(_rows(agents, "groups", base_dir, sources), "group")
+    for center in centers.values():
+        if isinstance(center.get("vehicles"), str):
+            center["vehicles"] = center["vehicles"].split()
+    for vehicle in vehicles.values():
+        require(centers, vehicle["home_center"], "center")
+    _assign_nearest_centers(groups, centers, map_data.locations)
+    for group in groups.values():
+        require(centers, group["assigned_center"], "center")
+    _check_attack_zones(data.get("events", {}), map_data.locations)
+    agents.update(centers=list(centers.values()), vehicles=list(vehicles.values()), groups=list(groups.values()))
+
+    config = Config(
+        simulation=data.get("simulation", {}),
+        xmpp=data.get("xmpp", {}),
+        map_data=map_data,
+        events=data.get("events", {}),
+        agents=agents,
+        centers=centers,
+        vehicles=vehicles,
+        groups=groups,
+        logging=data.get("logging", {}),
+        kpi=data.get("kpi", {}),
+    )
+    return config, sources
+
+
+def _source_stamps(sources):
+    stamps = []
+    for path in sources:
+        stat = os.stat(path)
+        stamps.append((path, stat.st_size, stat.st_mtime_ns))
+    return stamps
+
+
+def _snapshot_path(path, digest):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(base_dir, CACHE_DIR, f"{stem}-{digest[:16]}.pickle")
+
+
+def _read_snapshot(snapshot):
+    try:
+        with open(snapshot, "rb") as handle:
+            stamps, config = pickle.load(handle)
+        if _source_stamps(path for path, _, _ in stamps) == stamps:
+            return config
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+        pass
+    return None
+
+
+def _write_snapshot(snapshot, config, sources):
+    try:
+        os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+        tmp = f"{snapshot}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as handle:
+            pickle.dump((_source_stamps(sources), config), handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, snapshot)
+    except OSError:
+        pass
+
+
+def _read_raw(path):
+    with open(path, "rb") as handle:
+        raw = handle.read()
+    digest = hashlib.sha256(f"{COMPILER_DIGEST}:".encode() + raw).hexdigest()
+    return raw, _snapshot_path(path, digest)
+
+
+def _compile_raw(path, raw, snapshot, use_cache):
+    data = yaml.load(raw, Loader=_LOADER) or {}
+    config, sources = _compile(data, os.path.dirname(os.path.abspath(path)))
+    if use_cache:
+        _write_snapshot(snapshot, config, sources)
+    return config
+
+
+def compile_config(path, use_cache=True):
+    return _compile_raw(path, *_read_raw(path), use_cache)
+
+
+def load_config(path, use_cache=True):
+    raw, snapshot = _read_raw(path)
+    if use_cache:
+        config = _read_snapshot(snapshot)
+        if config is not None:
+            return config
+    return _compile_raw(path, raw, snapshot, use_cache)
+
+
+if __name__ == "__main__":
+    import sys
+
+    for config_path in sys.argv[1:] or ["config.yaml"]:
+        compiled = compile_config(config_path)
+        print(
+            f"Compiled {config_path}: {len(compiled.map_data.locations)} locations, {len(compiled.map_data.roads)} roads, "
+            f"{len(compiled.centers)} centers, {len(compiled.vehicles)} vehicles, {len(compiled.groups)} groups."
+        )
@@ -0,0 +1,116 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+from sim.utils import resource_phrase
+
+
+class Resources:
+    __slots__ = ("values", "include_zero")
+
+    def __init__(self, values, include_zero=False):
+        self.values = dict(values)
+        self.include_zero = include_zero
+
+    def __format__(self, spec):
+        return resource_phrase(self.values, include_zero=self.include_zero)
+
+    def __str__(self):
+        return format(self)
+
+
+class Event:
+    __slots__ = ("category", "template", "fields")
+
+    def __init__(self, category, template, fields):
+        self.category = category
+        self.template = template
+        self.fields = fields
+
+    def __str__(self):
+        return self.template.format(**self.fields)
+
+
+def log_event(logger, category, template, **fields):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(Event(category, template, fields))
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        event = record.msg
+        if isinstance(event, Event):
+            data = {"category": event.category}
+            for key, value in event.fields.items():
+                data[key] = value.values if isinstance(value, Resources) else value
+        else:
+            data = {"message": record.getMessage()}
+        data = {"time": round(record.created, 3), "level": record.levelname, "logger": record.name, **data}
+        return json.dumps(data, default=str)
+
+
+class EventFilter(logging.Filter):
+    def __init__(self, sample=None, rate_limit=None, seed=None):
+        super().__init__()
+        self.sample = {key: float(value) for key, value in (sample or {}).items()}
+        self.rate_limit = {key: float(value) for key, value in (rate_limit or {}).items()}
+        self.buckets = {}
+        self.random = random.Random(seed)
+
+    def filter(self, record):
+        category = getattr(record.msg, "category", None)
+        if category is None:
+            return True
+        rate = self.sample.get(category, self.sample.get("*", 1.0))
+        if rate < 1.0 and self.random.random() >= rate:
+            return False
+        limit = self.rate_limit.get(category, self.rate_limit.get("*"))
+        if limit is None:
+            return True
+        now = time.monotonic()
+        tokens, last = self.buckets.get(category, (limit, now))
+        tokens = min(limit, tokens + (now - last) * limit)
+        if tokens < 1.0:
+            self.buckets[category] = (tokens, now)
+            return False
+        self.buckets[category] = (tokens - 1.0, now)
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level, options=None):
+    options = options or {}
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for name in ("slixmpp", "spade", "spade.Agent", "spade.behaviour"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    output = options.get("output")
+    writer = logging.FileHandler(output, encoding="utf-8") if output else logging.StreamHandler(sys.stderr)
+    if options.get("format", "text") == "json":
+        writer.setFormatter(JsonLinesFormatter())
+    else:
+        writer.setFormatter(logging.Formatter("%(message)s"))
+    event_filter = EventFilter(options.get("sample"), options.get("rate_limit"), options.get("seed"))
+
+    if not options.get("background", True):
+        writer.addFilter(event_filter)
+        root.addHandler(writer)
+        return None
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(event_filter)
+    root.addHandler(handler)
+    listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+    listener.start()
+    return listener
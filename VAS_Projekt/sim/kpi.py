@@ -0,0 +1,171 @@
+import json
+import logging
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sim.eventlog import log_event
+from sim.utils import RESOURCE_TYPES, normalize_resources, total_resources
+
+
+LOGGER = logging.getLogger(__name__)
+LATENCY_BUCKETS = (*range(0, 21), 25, 30, 40, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count, self.total, self.max = 0, 0, 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank, seen = fraction * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 2) if self.count else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max if self.count else None,
+        }
+
+
+class KpiAggregator:
+    def __init__(self):
+        self.configure({})
+
+    def configure(self, options, centers=()):
+        self.enabled = bool(options.get("enabled", True))
+        self.snapshot_every = int(options.get("snapshot_every", 10))
+        self.summary_file = options.get("summary_file")
+        self.max_outstanding = int(options.get("max_outstanding", 10000))
+        self.burn_alpha = float(options.get("burn_alpha", 0.2))
+        self.tick = 0
+        self.outstanding = OrderedDict()
+        self.latency = Histogram()
+        self.requests = self.deliveries = self.dispatches = self.attacks = 0
+        self.stockout_ticks = {}
+        self.vehicle_ticks = {}
+        self.cargo_lost = normalize_resources({})
+        self.shipped = {center: {"total": 0, "window": 0} for center in centers}
+        self.burn_rate = {center: 0.0 for center in centers}
+        self.inventory = {}
+
+    def observe_tick(self, tick):
+        if not self.enabled or tick <= self.tick:
+            return
+        previous, self.tick = self.tick, tick
+        for center, shipped in self.shipped.items():
+            rate = shipped["window"] / (tick - previous)
+            current = self.burn_rate.get(center, 0.0)
+            self.burn_rate[center] = current + self.burn_alpha * (rate - current)
+            shipped["window"] = 0
+        if self.snapshot_every > 0 and tick // self.snapshot_every > previous // self.snapshot_every:
+            log_event(LOGGER, "kpi", "KPI at tick {tick}: {snapshot}", tick=tick, snapshot=self.snapshot())
+
+    def record_request(self, request_id, tick):
+        if not self.enabled:
+            return
+        self.requests += 1
+        self.outstanding[request_id] = tick
+        if len(self.outstanding) > self.max_outstanding:
+            self.outstanding.popitem(last=False)
+
+    def record_dispatch(self, center, shipment, inventory):
+        if not self.enabled:
+            return
+        self.dispatches += 1
+        amount = total_resources(shipment)
+        shipped = self.shipped.setdefault(center, {"total": 0, "window": 0})
+        shipped["total"] += amount
+        shipped["window"] += amount
+        self.inventory[center] = total_resources(inventory)
+
+    def record_delivery(self, request_id, tick):
+        if not self.enabled:
+            return
+        self.deliveries += 1
+        requested = self.outstanding.pop(request_id, None)
+        if requested is not None:
+            self.latency.add(max(0, tick - requested))
+
+    def record_attack(self, lost):
+        if not self.enabled:
+            return
+        self.attacks += 1
+        for key in RESOURCE_TYPES:
+            self.cargo_lost[key] += int(lost.get(key, 0))
+
+    def record_stock(self, group, stock, tick):
+        if not self.enabled:
+            return
+        empty = [key for key in RESOURCE_TYPES if stock.get(key, 0) <= 0]
+        if empty:
+            counts = self.stockout_ticks.setdefault(group, {key: 0 for key in RESOURCE_TYPES})
+            for key in empty:
+                counts[key] += 1
+        self.observe_tick(tick)
+
+    def record_vehicle(self, vehicle, busy):
+        if not self.enabled:
+            return
+        counts = self.vehicle_ticks.setdefault(vehicle, [0, 0])
+        counts[0] += 1 if busy else 0
+        counts[1] += 1
+
+    def snapshot(self):
+        busy = sum(counts[0] for counts in self.vehicle_ticks.values())
+        total = sum(counts[1] for counts in self.vehicle_ticks.values())
+        return {
+            "tick": self.tick,
+            "requests": self.requests,
+            "dispatches": self.dispatches,
+            "deliveries": self.deliveries,
+            "outstanding": len(self.outstanding),
+            "latency": self.latency.summary(),
+            "stockout_ticks": sum(sum(counts.values()) for counts in self.stockout_ticks.values()),
+            "vehicle_utilisation": round(busy / total, 3) if total else None,
+            "attacks": self.attacks,
+            "cargo_lost": dict(self.cargo_lost),
+        }
+
+    def summary(self):
+        result = self.snapshot()
+        result["stockout_ticks_by_group"] = self.stockout_ticks
+        result["vehicle_utilisation_by_vehicle"] = {
+            vehicle: round(busy / total, 3) for vehicle, (busy, total) in self.vehicle_ticks.items() if total
+        }
+        result["centers"] = {
+            center: {
+                "shipped": shipped["total"],
+                "burn_rate": round(self.burn_rate.get(center, 0.0), 2),
+                "inventory": self.inventory.get(center),
+            }
+            for center, shipped in self.shipped.items()
+        }
+        return result
+
+    def write_summary(self, path=None):
+        path = path or self.summary_file
+        if not self.enabled or not path:
+            return None
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(self.summary(), handle, indent=2)
+        return path
+
+
+KPI = KpiAggregator()
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import logging
 
@@ -5,38 +6,15 @@ from sim.agents.center import AidCenterAgent
 from sim.agents.group import AidGroupAgent
 from sim.agents.vehicle import VehicleAgent
 from sim.agents.world import WorldAgent
-from sim.config import load_config
+from sim.config import load_config, require
+from sim.eventlog import log_event, setup_logging
+from sim.kpi import KPI
+from sim.profiling import run_profiled
 from sim.utils import resource_phrase
 
 
-def _setup_logging(level):
-    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO), format="%(message)s")
-    for name in ("slixmpp", "spade", "spade.Agent", "spade.behaviour"):
-        logging.getLogger(name).setLevel(logging.WARNING)
-
-
-def _require(mapping, key, kind):
-    if key not in mapping:
-        raise ValueError(f"Unknown {kind} id: {key}")
-    return mapping[key]
-
-
-async def main():
-    config = load_config("config.yaml")
-    _setup_logging(config.simulation.get("log_level", "INFO"))
-
-    agents_cfg = config.agents
-    world_cfg = agents_cfg.get("world", {})
-    if not world_cfg:
-        raise ValueError("Missing world agent config")
-
-    centers_cfg = {c["id"]: c for c in agents_cfg.get("centers", [])}
-    vehicles_cfg = {v["id"]: v for v in agents_cfg.get("vehicles", [])}
-    groups_cfg = {g["id"]: g for g in agents_cfg.get("groups", [])}
-
-    world = WorldAgent(world_cfg["jid"], world_cfg["password"], config)
-    logger = logging.getLogger("sim")
-    world_jid = world_cfg["jid"]
+def log_scenario(config, logger):
+    centers_cfg, vehicles_cfg, groups_cfg = config.centers, config.vehicles, config.groups
     max_ticks = int(config.simulation.get("max_ticks", 60))
     tick_seconds = int(config.simulation.get("tick_seconds", 1))
     logger.info(
@@ -60,6 +38,18 @@ async def main():
             f"Resupply threshold: {resource_phrase(group.get('min_threshold', {}), include_zero=True)}."
         )
 
+
+def build_world(config):
+    world_cfg = config.agents["world"]
+    return WorldAgent(world_cfg["jid"], world_cfg["password"], config)
+
+
+def build_agents(config, center_ids=None):
+    centers_cfg, vehicles_cfg, groups_cfg = config.centers, config.vehicles, config.groups
+    world_jid = config.agents["world"]["jid"]
+    center_ids = list(centers_cfg) if center_ids is None else list(center_ids)
+    selected = set(center_ids)
+
     centers = [
         AidCenterAgent(
             c["jid"],
@@ -74,7 +64,7 @@ async def main():
                 vehicles_cfg[v]["jid"]: vehicles_cfg[v]["capacity"] for v in c.get("vehicles", []) if v in vehicles_cfg
             },
         )
-        for c in centers_cfg.values()
+        for c in (centers_cfg[center_id] for center_id in center_ids)
     ]
     vehicles = [
         VehicleAgent(
@@ -83,13 +73,14 @@ async def main():
             config,
             vehicle_id=v["id"],
             home_location=v["home"],
-            home_center_jid=_require(centers_cfg, v["home_center"], "center")["jid"],
+            home_center_jid=require(centers_cfg, v["home_center"], "center")["jid"],
             capacity=v["capacity"],
             world_jid=world_jid,
             base_edges=config.map_data.base_edges,
             adjacency=config.map_data.adjacency,
         )
         for v in vehicles_cfg.values()
+        if v["home_center"] in selected
     ]
     groups = [
         AidGroupAgent(
@@ -98,7 +89,7 @@ async def main():
             config,
             group_id=g["id"],
             location=g["location"],
-            assigned_center_jid=_require(centers_cfg, g["assigned_center"], "center")["jid"],
+            assigned_center_jid=require(centers_cfg, g["assigned_center"], "center")["jid"],
             stock=g.get("stock", {}),
             min_threshold=g.get("min_threshold", {}),
             max_capacity=g.get("max_capacity", {}),
@@ -106,23 +97,96 @@ async def main():
             world_jid=world_jid,
         )
         for g in groups_cfg.values()
+        if g["assigned_center"] in selected
     ]
+    return centers, vehicles, groups
+
+
+async def start_agents(config, centers, vehicles, groups):
+    start_limit = asyncio.Semaphore(max(1, int(config.simulation.get("start_concurrency", 32))))
+
+    async def start_agent(agent):
+        async with start_limit:
+            await agent.start()
 
-    all_agents = [world] + centers + vehicles + groups
-    await world.start()
-    await asyncio.gather(*(agent.start() for agent in centers + vehicles + groups))
+    for stage in (vehicles, centers, groups):
+        await asyncio.gather(*(start_agent(agent) for agent in stage))
 
-    await asyncio.sleep(max_ticks * tick_seconds + 2)
 
-    for agent in all_agents:
-        is_alive = getattr(agent, "is_alive", None)
-        if callable(is_alive) and not agent.is_alive():
-            continue
-        await agent.stop()
+def run_timeout(config):
+    max_ticks = int(config.simulation.get("max_ticks", 60))
+    tick_seconds = int(config.simulation.get("tick_seconds", 1))
+    return max_ticks * tick_seconds + float(config.simulation.get("start_timeout", 30))
+
+
+async def wait_for_world(config, world, logger, require_agents=False):
+    start_timeout = float(config.simulation.get("start_timeout", 30))
+    try:
+        await asyncio.wait_for(world.ready.wait(), timeout=start_timeout)
+    except asyncio.TimeoutError:
+        if require_agents and not any(world.registered.values()):
+            logger.error(f"No agent registered with the world within {start_timeout:g}s, aborting the run.")
+            return False
+        logger.warning(f"Not every agent registered within {start_timeout:g}s, starting the world anyway.")
+        world.begin()
+
+    try:
+        await asyncio.wait_for(world.finished.wait(), timeout=run_timeout(config))
+    except asyncio.TimeoutError:
+        logger.warning("World did not finish in time, stopping agents.")
+    return True
+
+
+async def stop_agents(agents):
+    await asyncio.gather(*(agent.stop() for agent in agents if agent.is_alive()))
 
-    await asyncio.sleep(1)
-    logger.info("Simulation finished.")
+
+def finish_kpi(logger, path=None):
+    log_event(logger, "kpi", "KPI summary: {summary}", summary=KPI.summary())
+    written = KPI.write_summary(path)
+    if written:
+        logger.info(f"KPI summary written to {written}.")
+
+
+async def main(config_path="config.yaml", deterministic=False, fingerprint=None):
+    config = load_config(config_path)
+    if deterministic:
+        config.simulation["deterministic"] = True
+    if fingerprint:
+        config.simulation["fingerprint_file"] = fingerprint
+    log_listener = setup_logging(config.simulation.get("log_level", "INFO"), config.logging)
+    try:
+        logger = logging.getLogger("sim")
+        log_scenario(config, logger)
+        KPI.configure(config.kpi, config.centers)
+
+        world = build_world(config)
+        centers, vehicles, groups = build_agents(config)
+
+        await world.start()
+        await start_agents(config, centers, vehicles, groups)
+        await wait_for_world(config, world, logger)
+
+        await stop_agents([world] + centers + vehicles + groups)
+        finish_kpi(logger)
+        logger.info("Simulation finished.")
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Run the humanitarian aid simulation.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--deterministic", action="store_true", help="run ticks in lockstep with a stable message order")
+    parser.add_argument("--fingerprint", help="write the per-tick state fingerprint to this file (deterministic mode)")
+    parser.add_argument("--profile", choices=("sample", "cprofile"), help="profile the run with a sampling profiler (collapsed stacks) or cProfile (.pstats only)")
+    parser.add_argument("--profile-out", default="profile", help="output prefix for profile files")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="sampling interval in seconds")
+    args = parser.parse_args()
+    if args.profile:
+        run_profiled(
+            lambda: main(args.config, args.deterministic, args.fingerprint), args.profile, args.profile_out, args.profile_interval
+        )
+    else:
+        asyncio.run(main(args.config, args.deterministic, args.fingerprint))
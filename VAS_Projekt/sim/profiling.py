@@ -0,0 +1,136 @@
+import asyncio
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from sim.utils import jid_user
+
+
+ACTIVE = False
+HANDLER_STATS = {}
+OUTSIDE = ("(loop)", "-", "(outside handlers)")
+TICK = None
+
+
+def observe_tick(tick):
+    global TICK
+    if TICK is None or tick > TICK:
+        TICK = tick
+
+
+async def profiled(agent, handler, func, *args):
+    if not ACTIVE:
+        return await func(*args)
+    tag = (type(agent).__name__, jid_user(agent.jid), handler)
+    start = time.perf_counter()
+    try:
+        return await func(*args)
+    finally:
+        stats = HANDLER_STATS.setdefault((tag[0], handler), [0, 0.0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+_PROFILED_CODE = profiled.__code__
+
+
+def frame_tag(frame):
+    while frame is not None:
+        if frame.f_code is _PROFILED_CODE:
+            return frame.f_locals.get("tag") or OUTSIDE
+        frame = frame.f_back
+    return OUTSIDE
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name="sim-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.by_handler = Counter()
+        self.by_tick = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            kind, agent, handler = frame_tag(frame)
+            tick = TICK
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            self.stacks[";".join([kind, agent, handler] + names[::-1])] += 1
+            self.by_handler[(kind, handler)] += 1
+            if tick is not None:
+                self.by_tick[tick] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as handle:
+            for stack, count in self.stacks.most_common():
+                handle.write(f"{stack} {count}\n")
+
+
+def write_handler_table(path, sampler=None, stats=None):
+    total_samples = sum(sampler.by_handler.values()) if sampler else 0
+    keys = set(HANDLER_STATS) | (set(sampler.by_handler) if sampler else set())
+    rows = []
+    for key in keys:
+        calls, wall = HANDLER_STATS.get(key, (0, 0.0))
+        samples = sampler.by_handler.get(key, 0) if sampler else 0
+        rows.append((key[0], key[1], calls, wall, samples))
+    rows.sort(key=lambda row: (row[4], row[3]), reverse=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("elapsed_s includes time suspended in awaits; samples and share count time on the CPU stack.\n\n")
+        handle.write(f"{'agent':<16} {'handler':<28} {'calls':>9} {'elapsed_s':>10} {'mean_ms':>9} {'samples':>9} {'share':>7}\n")
+        for kind, handler, calls, wall, samples in rows:
+            mean = wall / calls * 1000 if calls else 0.0
+            share = samples / total_samples if total_samples else 0.0
+            handle.write(f"{kind:<16} {handler:<28} {calls:>9} {wall:>10.3f} {mean:>9.3f} {samples:>9} {share:>7.1%}\n")
+        if sampler and sampler.by_tick:
+            busiest = ", ".join(f"{tick}={count}" for tick, count in sampler.by_tick.most_common(10))
+            handle.write(f"\nBusiest ticks by samples: {busiest}\n")
+        if stats is not None:
+            handle.write("\ncProfile records no call stacks, so no .collapsed file is written; use --profile sample for flame graphs.\n")
+            handle.write("\nTop functions by cumulative time (cProfile):\n")
+            stats.stream = handle
+            stats.sort_stats("cumulative").print_stats(25)
+
+
+def run_profiled(coro_factory, mode, prefix, interval=0.005):
+    global ACTIVE, TICK
+    ACTIVE, TICK = True, None
+    HANDLER_STATS.clear()
+    sampler = stats = None
+    try:
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                asyncio.run(coro_factory())
+            finally:
+                profiler.disable()
+                profiler.dump_stats(f"{prefix}.pstats")
+                stats = pstats.Stats(profiler)
+        else:
+            sampler = Sampler(threading.get_ident(), interval)
+            sampler.start()
+            try:
+                asyncio.run(coro_factory())
+            finally:
+                sampler.stop()
+                sampler.write_collapsed(f"{prefix}.collapsed")
+        write_handler_table(f"{prefix}.handlers.txt", sampler, stats)
+    finally:
+        ACTIVE = False
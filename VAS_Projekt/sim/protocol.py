@@ -12,14 +12,62 @@ MSG_VEHICLE_STATUS = "vehicle_status"
 MSG_ATTACK = "attack"
 MSG_DEMAND_UPDATE = "demand_update"
 MSG_SHUTDOWN = "shutdown"
+MSG_SUBSCRIBE = "subscribe"
+MSG_UNSUBSCRIBE = "unsubscribe"
+MSG_SUBSCRIBED = "subscribed"
+MSG_BATCH = "batch"
+MSG_LEAD_TIME = "lead_time"
+MSG_TICK = "tick"
+MSG_TICK_DONE = "tick_done"
 
+CONTROL_TYPES = frozenset((MSG_TICK, MSG_TICK_DONE, MSG_SHUTDOWN))
 
-def make_message(to, msg_type, payload):
+TOPIC_WORLD_INCIDENTS = "world.incidents"
+
+
+def vehicle_status_topic(center):
+    return f"vehicle.status.{center}"
+
+
+def lead_time_topic(center):
+    return f"center.lead_time.{center}"
+
+
+def topic_matches(filters, payload):
+    for key, allowed in (filters or {}).items():
+        if key not in payload:
+            continue
+        value = payload[key]
+        values = value if isinstance(value, (list, tuple)) else (value,)
+        if not any(item in allowed for item in values):
+            return False
+    return True
+
+
+def make_message(to, msg_type, payload, topic=None):
     msg = Message(to=to)
     msg.set_metadata("type", msg_type)
+    if topic:
+        msg.set_metadata("topic", topic)
     msg.body = json.dumps(payload)
     return msg
 
 
+def make_batch_message(to, entries):
+    messages = [{"type": msg_type, "payload": payload, "topic": topic} for msg_type, payload, topic in entries]
+    return make_message(to, MSG_BATCH, {"messages": messages})
+
+
+def message_stamp(msg):
+    return int(msg.get_metadata("tick") or 0)
+
+
 def parse_message(msg):
     return msg.get_metadata("type"), (json.loads(msg.body) if msg.body else {})
+
+
+def parse_messages(msg):
+    msg_type, payload = parse_message(msg)
+    if msg_type != MSG_BATCH:
+        return [(msg_type, payload)]
+    return [(item.get("type"), item.get("payload") or {}) for item in payload.get("messages", [])]
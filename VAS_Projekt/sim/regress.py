@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_once(config_path, fingerprint_path):
+    command = [
+        sys.executable, "-m", "sim.main", "--config", config_path, "--deterministic", "--fingerprint", fingerprint_path,
+    ]
+    start = time.perf_counter()
+    subprocess.run(command, check=True, capture_output=True)
+    wall = time.perf_counter() - start
+    with open(fingerprint_path, "r", encoding="utf-8") as handle:
+        fingerprints = [json.loads(line) for line in handle if line.strip()]
+    return wall, fingerprints
+
+
+def measure(config_path, runs):
+    walls, fingerprints = [], None
+    with tempfile.TemporaryDirectory() as tmp:
+        for index in range(max(1, runs)):
+            wall, current = run_once(config_path, os.path.join(tmp, f"run{index}.jsonl"))
+            if fingerprints is not None and current != fingerprints:
+                raise RuntimeError("Run is not deterministic: fingerprints differ between repeated runs.")
+            walls.append(wall)
+            fingerprints = current
+    return min(walls), fingerprints
+
+
+def first_mismatch(expected, actual):
+    for want, got in zip(expected, actual):
+        if want != got:
+            return want.get("tick")
+    if len(expected) != len(actual):
+        shorter = expected if len(expected) < len(actual) else actual
+        return shorter[-1]["tick"] + 1 if shorter else 1
+    return None
+
+
+def compare(baseline, wall, fingerprints, max_slowdown):
+    problems = []
+    tick = first_mismatch(baseline["fingerprints"], fingerprints)
+    if tick is not None:
+        problems.append(f"fingerprint diverges from the baseline at tick {tick}")
+    ratio = wall / baseline["wall_time"] if baseline.get("wall_time") else None
+    if ratio is not None and max_slowdown and ratio > max_slowdown:
+        problems.append(f"wall time {wall:.2f}s is {ratio:.2f}x the baseline {baseline['wall_time']:.2f}s")
+    return problems, ratio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a deterministic run against a recorded fingerprint baseline.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--baseline", default="regress_baseline.json")
+    parser.add_argument("--record", action="store_true", help="write a new baseline instead of comparing")
+    parser.add_argument("--runs", type=int, default=1, help="repeat the run and keep the fastest wall time")
+    parser.add_argument("--max-slowdown", type=float, default=1.25, help="allowed wall-time ratio (0 disables)")
+    args = parser.parse_args(argv)
+
+    wall, fingerprints = measure(args.config, args.runs)
+    final = fingerprints[-1]["fingerprint"] if fingerprints else None
+    if args.record:
+        baseline = {"config": args.config, "wall_time": round(wall, 3), "final": final, "fingerprints": fingerprints}
+        with open(args.baseline, "w", encoding="utf-8") as handle:
+            json.dump(baseline, handle, indent=1)
+        print(f"Recorded baseline {args.baseline}: {len(fingerprints)} ticks, {wall:.2f}s, final {final}.")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    problems, ratio = compare(baseline, wall, fingerprints, args.max_slowdown)
+    ratio_text = f" ({ratio:.2f}x baseline)" if ratio is not None else ""
+    print(f"Run took {wall:.2f}s{ratio_text}, final fingerprint {final}.")
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from sim.config import load_config
+from sim.eventlog import setup_logging
+from sim.kpi import KPI
+from sim.main import (
+    build_agents,
+    build_world,
+    finish_kpi,
+    log_scenario,
+    run_timeout,
+    start_agents,
+    stop_agents,
+    wait_for_world,
+)
+
+
+def partition(config, workers):
+    weights = {center_id: 1 for center_id in config.centers}
+    for vehicle in config.vehicles.values():
+        weights[vehicle["home_center"]] += 1
+    for group in config.groups.values():
+        weights[group["assigned_center"]] += 1
+    shards = [[] for _ in range(max(1, min(workers, len(weights))))]
+    loads = [0] * len(shards)
+    for center_id in sorted(weights, key=lambda c: (-weights[c], c)):
+        index = loads.index(min(loads))
+        shards[index].append(center_id)
+        loads[index] += weights[center_id]
+    return shards
+
+
+async def _world_process(config_path, online):
+    config = load_config(config_path)
+    log_listener = setup_logging(config.simulation.get("log_level", "INFO"), config.logging)
+    try:
+        logger = logging.getLogger("sim")
+        log_scenario(config, logger)
+        world = build_world(config)
+        await world.start()
+        online.set()
+        connected = await wait_for_world(config, world, logger, require_agents=True)
+        await stop_agents([world])
+        if connected:
+            logger.info("Simulation finished.")
+        return connected
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
+
+
+def _shard_summary_path(config, index):
+    path = config.kpi.get("summary_file")
+    if not path:
+        return None
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.shard{index}{ext}"
+
+
+async def _shard_process(config_path, center_ids, index):
+    config = load_config(config_path)
+    log_listener = setup_logging(config.simulation.get("log_level", "INFO"), config.logging)
+    try:
+        KPI.configure(config.kpi, center_ids)
+        centers, vehicles, groups = build_agents(config, center_ids)
+        agents = centers + vehicles + groups
+        await start_agents(config, centers, vehicles, groups)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + run_timeout(config) + float(config.simulation.get("start_timeout", 30))
+        while any(agent.is_alive() for agent in agents) and loop.time() < deadline:
+            await asyncio.sleep(0.2)
+        await stop_agents(agents)
+        finish_kpi(logging.getLogger("sim"), _shard_summary_path(config, index))
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
+
+
+def _run_world(config_path, online):
+    if not asyncio.run(_world_process(config_path, online)):
+        raise SystemExit(1)
+
+
+def _run_shard(config_path, center_ids, index):
+    asyncio.run(_shard_process(config_path, center_ids, index))
+
+
+def run(config_path, workers):
+    config = load_config(config_path)
+    shards = partition(config, workers)
+    context = multiprocessing.get_context("spawn")
+    online = context.Event()
+    world = context.Process(target=_run_world, args=(config_path, online), name="sim-world")
+    world.start()
+    if not online.wait(float(config.simulation.get("start_timeout", 30))):
+        world.terminate()
+        raise RuntimeError("World agent did not come online")
+    processes = [
+        context.Process(target=_run_shard, args=(config_path, center_ids, index), name=f"sim-shard-{index}")
+        for index, center_ids in enumerate(shards)
+    ]
+    for process in processes:
+        process.start()
+    world.join()
+    if world.exitcode:
+        for process in processes:
+            process.terminate()
+    for process in processes:
+        process.join()
+    return max(process.exitcode or 0 for process in [world] + processes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the simulation with centers sharded across worker processes.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    args = parser.parse_args()
+    raise SystemExit(run(args.config, args.workers))
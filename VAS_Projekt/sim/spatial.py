@@ -0,0 +1,122 @@
+import math
+from bisect import bisect_left, insort
+
+
+def suggest_cell_size(points):
+    points = list(points)
+    if not points:
+        return 1.0
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    extent = max(max(xs) - min(xs), max(ys) - min(ys))
+    return extent / math.isqrt(len(points)) if extent > 0 else 1.0
+
+
+class GridIndex:
+    def __init__(self, cell_size=1.0):
+        self.cell_size = float(cell_size) if cell_size and cell_size > 0 else 1.0
+        self.cells = {}
+        self.positions = {}
+        self.keys = []
+        self.bounds = (0, 0, 0, 0)
+
+    @classmethod
+    def from_points(cls, items, cell_size=None):
+        items = dict(items)
+        index = cls(cell_size or suggest_cell_size(items.values()))
+        for key, (x, y) in items.items():
+            index.insert(key, x, y)
+        return index
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def insert(self, key, x, y):
+        old = self.positions.get(key)
+        cell = self._cell(x, y)
+        if old is not None:
+            old_cell = self._cell(*old)
+            if old_cell != cell:
+                self._discard(old_cell, key)
+        else:
+            insort(self.keys, key)
+        self.positions[key] = (x, y)
+        self.cells.setdefault(cell, set()).add(key)
+        if len(self.positions) == 1:
+            self.bounds = (*cell, *cell)
+        else:
+            min_cx, min_cy, max_cx, max_cy = self.bounds
+            self.bounds = (min(min_cx, cell[0]), min(min_cy, cell[1]), max(max_cx, cell[0]), max(max_cy, cell[1]))
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        self._discard(self._cell(*position), key)
+        del self.keys[bisect_left(self.keys, key)]
+
+    def _discard(self, cell, key):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    def choice(self, rng):
+        return rng.choice(self.keys) if self.keys else None
+
+    def within(self, x, y, radius):
+        (min_cx, min_cy), (max_cx, max_cy) = self._cell(x - radius, y - radius), self._cell(x + radius, y + radius)
+        limit = radius * radius
+        found = []
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self.cells):
+            cells = [members for (cx, cy), members in self.cells.items() if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+        else:
+            cells = [
+                self.cells[(cx, cy)]
+                for cx in range(min_cx, max_cx + 1)
+                for cy in range(min_cy, max_cy + 1)
+                if (cx, cy) in self.cells
+            ]
+        for members in cells:
+            for key in members:
+                px, py = self.positions[key]
+                if (px - x) ** 2 + (py - y) ** 2 <= limit:
+                    found.append(key)
+        return sorted(found)
+
+    def nearest(self, x, y):
+        if not self.positions:
+            return None
+        cx, cy = self._cell(x, y)
+        min_cx, min_cy, max_cx, max_cy = self.bounds
+        max_ring = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy, 0)
+        best, best_dist = None, math.inf
+        for ring in range(max_ring + 1):
+            for cell in self._ring(cx, cy, ring):
+                for key in self.cells.get(cell, ()):
+                    px, py = self.positions[key]
+                    dist = (px - x) ** 2 + (py - y) ** 2
+                    if dist < best_dist or (dist == best_dist and key < best):
+                        best, best_dist = key, dist
+            if best is not None and best_dist <= (ring * self.cell_size) ** 2:
+                break
+        return best
+
+    @staticmethod
+    def _ring(cx, cy, ring):
+        if ring == 0:
+            yield cx, cy
+            return
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy